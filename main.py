@@ -1,27 +1,40 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-import json
+import errno
+import hashlib
+import itertools
 import os
+import socket
 import random
 import time
 import uuid
-from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
 
 import httpx
+import msgspec
+import orjson
+from pybloom_live import ScalableBloomFilter
+
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None  # e.g. Windows; the stdlib selector loop still works
 
 GRAPHQL_ENDPOINT = (
     "https://www.farmaciasdesimilares.com/_v/segment/graphql/v1"
     "?workspace=master&maxAge=short&appsEtag=remove&domain=store&locale=es-MX"
 )
 
-# VTEX search-graphql query for productSearch (returns products and recordsFiltered)
-PRODUCT_SEARCH_QUERY = """
-query SearchAll($selectedFacets: [SelectedFacetInput!], $from: Int!, $to: Int!, $orderBy: String) {
-  productSearch(selectedFacets: $selectedFacets, from: $from, to: $to, orderBy: $orderBy)
-  @context(provider: "vtex.search-graphql") {
+# Shared selection body for productSearch (products and recordsFiltered),
+# used by both the single-page query and the aliased batched query.
+FRAGMENT_PRODUCT_FIELDS = """
     products {
       productId
       productName
@@ -58,20 +71,137 @@ query SearchAll($selectedFacets: [SelectedFacetInput!], $from: Int!, $to: Int!,
       }
     }
     recordsFiltered
-  }
-}
-""".strip()
+""".strip("\n")
+
+_QUERY_CACHE: Dict[int, str] = {}
+
+def build_batched_query(k: int) -> str:
+    """
+    K aliased productSearch selections (p0..p{k-1}) in one operation, sharing
+    $selectedFacets/$orderBy but with per-alias $from{i}/$to{i} windows.
+    Built once per k and cached.
+    """
+    cached = _QUERY_CACHE.get(k)
+    if cached is not None:
+        return cached
+    var_defs = ["$selectedFacets: [SelectedFacetInput!]", "$orderBy: String"]
+    selections = []
+    for i in range(k):
+        var_defs.append(f"$from{i}: Int!")
+        var_defs.append(f"$to{i}: Int!")
+        selections.append(
+            f"  p{i}: productSearch(selectedFacets: $selectedFacets, from: $from{i}, to: $to{i}, orderBy: $orderBy)\n"
+            '  @context(provider: "vtex.search-graphql") {\n'
+            f"{FRAGMENT_PRODUCT_FIELDS}\n"
+            "  }"
+        )
+    query = (
+        "query SearchAll(" + ", ".join(var_defs) + ") {\n"
+        + "\n".join(selections)
+        + "\n}"
+    )
+    _QUERY_CACHE[k] = query
+    return query
 
 # Conservative, browser-like defaults
 HEADERS = {
     "Accept": "application/json",
     "Content-Type": "application/json",
+    # Product trees compress 5-10x; httpx decompresses transparently
+    "Accept-Encoding": "br, gzip, deflate",
     "Accept-Language": "es-MX,es;q=0.9",
     "User-Agent": "Mozilla/5.0 (compatible; catalog-scraper/1.0; +scraper)",
 }
 
+# Typed mirrors of the SearchAll selection. msgspec decodes response bodies
+# straight into these structs (unknown fields are ignored), which is faster
+# than materializing dicts and gives attribute access on the dedup path.
+class ProductCluster(msgspec.Struct, frozen=True):
+    id: Optional[str] = None
+    name: Optional[str] = None
+
+class PriceValues(msgspec.Struct, frozen=True):
+    lowPrice: Optional[float] = None
+    highPrice: Optional[float] = None
+
+class PriceRange(msgspec.Struct, frozen=True):
+    sellingPrice: Optional[PriceValues] = None
+    listPrice: Optional[PriceValues] = None
+
+class TeaserParameter(msgspec.Struct, frozen=True):
+    name: Optional[str] = None
+    value: Optional[str] = None
+
+class TeaserConditions(msgspec.Struct, frozen=True):
+    minimumQuantity: Optional[int] = None
+    parameters: List[TeaserParameter] = []
+
+class TeaserEffects(msgspec.Struct, frozen=True):
+    parameters: List[TeaserParameter] = []
+
+class Teaser(msgspec.Struct, frozen=True):
+    name: Optional[str] = None
+    conditions: Optional[TeaserConditions] = None
+    effects: Optional[TeaserEffects] = None
+
+class DiscountHighlight(msgspec.Struct, frozen=True):
+    name: Optional[str] = None
+
+class CommertialOffer(msgspec.Struct, frozen=True):
+    Price: Optional[float] = None
+    ListPrice: Optional[float] = None
+    spotPrice: Optional[float] = None
+    AvailableQuantity: Optional[int] = None
+    PriceValidUntil: Optional[str] = None
+    discountHighlights: List[DiscountHighlight] = []
+    teasers: List[Teaser] = []
+
+class Seller(msgspec.Struct, frozen=True):
+    sellerId: Optional[str] = None
+    sellerName: Optional[str] = None
+    commertialOffer: Optional[CommertialOffer] = None
+
+class ItemImage(msgspec.Struct, frozen=True):
+    imageUrl: Optional[str] = None
+    imageText: Optional[str] = None
+
+class Item(msgspec.Struct, frozen=True):
+    itemId: Optional[str] = None
+    ean: Optional[str] = None
+    images: List[ItemImage] = []
+    sellers: List[Seller] = []
+
+class Product(msgspec.Struct, frozen=True):
+    productId: Optional[str] = None
+    productName: Optional[str] = None
+    categoryId: Optional[str] = None
+    categories: List[str] = []
+    productClusters: List[ProductCluster] = []
+    link: Optional[str] = None
+    linkText: Optional[str] = None
+    priceRange: Optional[PriceRange] = None
+    items: List[Item] = []
+
+class PageNode(msgspec.Struct, frozen=True):
+    products: List[Product] = []
+    recordsFiltered: int = 0
+
+class GraphQLResponse(msgspec.Struct, frozen=True):
+    # Both the single productSearch and the aliased p0..p{k-1} responses
+    # decode through the same alias->node mapping.
+    data: Optional[Dict[str, Optional[PageNode]]] = None
+    errors: Optional[List[Dict[str, Any]]] = None
+
+DECODER = msgspec.json.Decoder(GraphQLResponse)
+
 def utc_ts() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H-%M-%SZ")
+    # strftime pays locale/format-string overhead; plain f-string formatting
+    # of gmtime fields is much cheaper if this ever runs per record
+    t = time.gmtime()
+    return (
+        f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}"
+        f"T{t.tm_hour:02d}-{t.tm_min:02d}-{t.tm_sec:02d}Z"
+    )
 
 def ensure_dir(p: Path):
     p.mkdir(parents=True, exist_ok=True)
@@ -96,86 +226,333 @@ def load_proxies(path: Path) -> List[str]:
     return proxies
 
 class ProxyRotator:
-    def __init__(self, proxies: List[str]):
+    def __init__(self, proxies: List[str], timeout_s: float = 25.0, per_proxy_streams: int = 100):
         self.proxies = proxies
         self.n = len(proxies)
-        self.idx = 0
-        self.lock = asyncio.Lock()
+        # All coroutines share one thread, so round-robin needs no lock
+        self._it = itertools.cycle(proxies) if proxies else None
+        # One persistent client per proxy so the TLS + HTTP/2 handshake is
+        # paid once per proxy instead of once per request.
+        self.timeout = httpx.Timeout(timeout_s)
+        self.limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        # Cap in-flight requests per proxy at the server's HTTP/2
+        # max_concurrent_streams (100 for VTEX/Cloudflare) so pages
+        # multiplex on one connection instead of queueing new ones.
+        self.per_proxy_streams = per_proxy_streams
+        self.sems: Dict[str, asyncio.Semaphore] = {}
+
+    def next(self) -> Optional[str]:
+        return next(self._it) if self._it is not None else None
+
+    def client_for(self, proxy_url: Optional[str]) -> httpx.AsyncClient:
+        key = proxy_url or ""
+        client = self.clients.get(key)
+        if client is None:
+            # Explicit transport so we can disable Nagle (small POST bodies
+            # otherwise risk a delayed-ACK stall) and widen the kernel
+            # receive buffer for the large response bodies.
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                verify=True,
+                limits=self.limits,
+                proxy=proxy_url,           # single string URL, not a dict
+                retries=0,
+                socket_options=[
+                    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                    (socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20),
+                ],
+            )
+            client = httpx.AsyncClient(
+                headers=HEADERS,
+                timeout=self.timeout,
+                transport=transport,
+                trust_env=False,           # avoid env proxy interference
+                follow_redirects=False,
+            )
+            self.clients[key] = client
+        return client
+
+    def sem_for(self, proxy_url: Optional[str]) -> asyncio.Semaphore:
+        key = proxy_url or ""
+        sem = self.sems.get(key)
+        if sem is None:
+            sem = asyncio.Semaphore(self.per_proxy_streams)
+            self.sems[key] = sem
+        return sem
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+
+class AdaptiveGate:
+    """
+    AIMD concurrency gate: every success nudges the in-flight limit up by
+    one, every rate-limit response halves it, so throughput settles just
+    under what the server and proxies tolerate without manual tuning.
+    """
+
+    def __init__(self, initial: int, max_limit: int = 200, min_limit: int = 1):
+        self.limit = min(max(min_limit, initial), max_limit)
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def record_success(self):
+        # Additive increase; waiters pick the wider limit up on next release
+        if self.limit < self.max_limit:
+            self.limit += 1
+
+    def record_failure(self):
+        # Multiplicative decrease on 429/503
+        self.limit = max(self.min_limit, self.limit // 2)
+
+class UringBatchWriter:
+    """
+    Append-only JSONL sink backed by io_uring. Records accumulate in
+    `pending` and flush() drains them in batched, linked submits,
+    amortizing syscalls versus one write(2) per line. flush() blocks on
+    completions, so async callers should run it via asyncio.to_thread.
+    Requires liburing; callers fall back to a plain buffered file when it
+    is unavailable.
+    """
+
+    QUEUE_DEPTH = 64
+
+    def __init__(self, path: Path):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.ring = liburing.Ring()
+        liburing.io_uring_queue_init(self.QUEUE_DEPTH, self.ring)
+        self.cqe = liburing.Cqe()
+        # Queued buffers must stay alive until their completions are seen
+        self.pending: List[bytes] = []
+
+    def write(self, buf: bytes):
+        self.pending.append(buf)
+
+    def flush(self):
+        while self.pending:
+            batch = self.pending[: self.QUEUE_DEPTH]
+            del self.pending[: len(batch)]
+            self._write_batch(batch)
+
+    def _write_batch(self, bufs: List[bytes]):
+        # SQEs are linked so the kernel executes the writes in order: a
+        # short write cancels the rest of the chain (-ECANCELED) instead of
+        # letting later records land in front of the missing tail.
+        while bufs:
+            remaining = dict(enumerate(bufs))
+            for tag, buf in remaining.items():
+                sqe = liburing.io_uring_get_sqe(self.ring)
+                liburing.io_uring_prep_write(sqe, self.fd, buf)
+                liburing.io_uring_sqe_set_data64(sqe, tag)
+                if tag != len(bufs) - 1:
+                    sqe.flags |= liburing.IOSQE_IO_LINK
+            liburing.io_uring_submit(self.ring)
+            redo: Dict[int, bytes] = {}
+            for _ in range(len(bufs)):
+                # Reap one CQE per wait: indexing self.cqe past the head
+                # breaks once a batch's completions straddle the CQ ring
+                # wrap, so always read the current head and mark it seen.
+                liburing.io_uring_wait_cqe(self.ring, self.cqe)
+                cqe = self.cqe[0]
+                tag, res = cqe.user_data, cqe.res
+                buf = remaining[tag]
+                if res == -errno.ECANCELED:
+                    # Cancelled behind a short write; resubmit untouched
+                    redo[tag] = buf
+                elif res < 0:
+                    raise OSError(-res, os.strerror(-res))
+                elif res == 0:
+                    # Zero-length completion: resubmit like a short write
+                    redo[tag] = buf
+                elif res < len(buf):
+                    # Short write: only the tail goes back on the queue
+                    redo[tag] = buf[res:]
+                liburing.io_uring_cqe_seen(self.ring, cqe)
+            bufs = [redo[tag] for tag in sorted(redo)]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            liburing.io_uring_queue_exit(self.ring)
+            os.close(self.fd)
+
+# Retry backoff schedule (seconds), jittered by up to 0.5s per sleep
+_BACKOFF = (2.0, 4.0, 6.0, 8.0)
+
+# Automatic persisted queries (APQ): once a query's sha256 is registered
+# server-side, requests send only hash + variables (~200B) instead of the
+# ~2KB query text. Hashes in this set have been sent with their full query.
+_APQ_REGISTERED: set = set()
+
+# Hashes the server answered with PersistedQueryNotFound after we sent the
+# full query alongside them: it does not retain registrations, so these
+# queries stay in full-query mode instead of paying a miss round trip
+# before every request.
+_APQ_REJECTED: set = set()
+
+_QUERY_HASHES: Dict[str, str] = {}
+
+def _query_hash(query: str) -> str:
+    qhash = _QUERY_HASHES.get(query)
+    if qhash is None:
+        qhash = hashlib.sha256(query.encode()).hexdigest()
+        _QUERY_HASHES[query] = qhash
+    return qhash
+
+def _apq_payload(query: str, variables: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    qhash = _query_hash(query)
+    payload: Dict[str, Any] = {
+        "operationName": "SearchAll",
+        "variables": variables,
+    }
+    if qhash in _APQ_REJECTED:
+        # Full-query mode: the server discards registrations for this hash
+        payload["query"] = query
+        return payload, qhash
+    payload["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": qhash}}
+    if qhash not in _APQ_REGISTERED:
+        payload["query"] = query
+    return payload, qhash
+
+# Steady-state payloads come from cached byte templates: per query shape,
+# everything but the from/to integers is constant, so building a request
+# body is one %-format instead of a full JSON encode.
+_TEMPLATE_CACHE: Dict[Tuple[str, bytes, bytes], bytes] = {}
+
+def _payload_template(qhash: str, k: int, facets_bytes: bytes, order_bytes: bytes) -> bytes:
+    key = (qhash, facets_bytes, order_bytes)
+    tmpl = _TEMPLATE_CACHE.get(key)
+    if tmpl is None:
+        head = (
+            b'{"operationName":"SearchAll","variables":{"selectedFacets":'
+            + facets_bytes
+            + b',"orderBy":'
+            + order_bytes
+        ).replace(b"%", b"%%")  # facet/orderBy text may contain literal %
+        windows = b"".join(b',"from%d":%%d,"to%d":%%d' % (i, i) for i in range(k))
+        tail = (
+            b'},"extensions":{"persistedQuery":{"version":1,"sha256Hash":"'
+            + qhash.encode()
+            + b'"}}}'
+        )
+        tmpl = head + windows + tail
+        _TEMPLATE_CACHE[key] = tmpl
+    return tmpl
 
-    async def next(self) -> Optional[str]:
-        async with self.lock:
-            if self.n == 0:
-                return None
-            p = self.proxies[self.idx]
-            self.idx = (self.idx + 1) % self.n
-            return p
+def _apq_content(query: str, variables: Dict[str, Any]) -> Tuple[bytes, str]:
+    """
+    Encode the request body. Once the query hash is registered, fill the
+    cached byte template; otherwise fall back to a full JSON encode that
+    carries the query text.
+    """
+    qhash = _query_hash(query)
+    if qhash in _APQ_REGISTERED:
+        k = sum(1 for key in variables if key.startswith("from"))
+        facets_bytes = orjson.dumps(variables.get("selectedFacets") or [])
+        order_bytes = orjson.dumps(variables.get("orderBy"))
+        tmpl = _payload_template(qhash, k, facets_bytes, order_bytes)
+        vals: List[int] = []
+        for i in range(k):
+            vals.append(variables[f"from{i}"])
+            vals.append(variables[f"to{i}"])
+        return tmpl % tuple(vals), qhash
+    payload, qhash = _apq_payload(query, variables)
+    return orjson.dumps(payload), qhash
+
+def _persisted_query_miss(errors: Optional[List[Dict[str, Any]]]) -> bool:
+    return any(
+        isinstance(e, dict)
+        and (
+            "PersistedQueryNotFound" in str(e.get("message", ""))
+            or (e.get("extensions") or {}).get("code") == "PERSISTED_QUERY_NOT_FOUND"
+        )
+        for e in errors or []
+    )
 
 async def graphql_post_json(
     query: str,
     variables: Dict[str, Any],
-    proxy_url: Optional[str],
-    timeout_s: float = 25.0,
+    client: httpx.AsyncClient,
+    gate: Optional[AdaptiveGate] = None,
     max_retries: int = 4,
-) -> Dict[str, Any]:
+) -> Dict[str, Optional[PageNode]]:
     """
-    Single GraphQL POST with retries, backoff, and per-call proxy binding.
-    Uses HTTPX ≥0.28 'proxy=' API; 'proxies=' is not used.
+    Single GraphQL POST with retries and backoff on a persistent client,
+    decoded straight into typed structs. Uses HTTPX ≥0.28 'proxy=' API;
+    'proxies=' is not used.
     """
     last_exc: Optional[Exception] = None
 
-    # Reasonable connection limits for async scraping
-    limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
-
-    # Structured timeout
-    timeout = httpx.Timeout(timeout_s)
-
     for attempt in range(1, max_retries + 1):
         try:
-            async with httpx.AsyncClient(
-                headers=HEADERS,
-                timeout=timeout,
-                limits=limits,
-                http2=True,
-                verify=True,
-                proxy=proxy_url,           # single string URL, not a dict
-                trust_env=False,           # avoid env proxy interference
-                follow_redirects=False,
-            ) as client:
-                payload = {
-                    "operationName": "SearchAll",
-                    "query": query,
-                    "variables": variables,
-                }
-                resp = await client.post(GRAPHQL_ENDPOINT, json=payload)
+            content, qhash = _apq_content(query, variables)
+            resp = await client.post(GRAPHQL_ENDPOINT, content=content)
+            if gate is not None and resp.status_code in (429, 503):
+                gate.record_failure()
+            resp.raise_for_status()
+            body = DECODER.decode(resp.content)
+            if _persisted_query_miss(body.errors):
+                # A miss on the hash-only path means the server dropped a
+                # registration we already paid for: stop retrying APQ for
+                # this query and resend (and stay with) the full text.
+                _APQ_REGISTERED.discard(qhash)
+                _APQ_REJECTED.add(qhash)
+                content, qhash = _apq_content(query, variables)
+                resp = await client.post(GRAPHQL_ENDPOINT, content=content)
                 resp.raise_for_status()
-                data = resp.json()
-                if isinstance(data, dict) and "errors" in data:
-                    raise RuntimeError(f"GraphQL errors: {data['errors']}")
-                return data["data"]
+                body = DECODER.decode(resp.content)
+            if body.errors:
+                raise RuntimeError(f"GraphQL errors: {body.errors}")
+            if gate is not None:
+                gate.record_success()
+            if qhash not in _APQ_REJECTED:
+                _APQ_REGISTERED.add(qhash)
+            return body.data or {}
         except Exception as e:
             last_exc = e
-            # Exponential backoff with jitter
-            sleep_s = min(2.0 * attempt, 8.0) + random.uniform(0.0, 0.5)
+            sleep_s = _BACKOFF[min(attempt - 1, len(_BACKOFF) - 1)] + random.random() * 0.5
             await asyncio.sleep(sleep_s)
 
     raise RuntimeError(f"Request failed after {max_retries} attempts: {last_exc}")
 
-async def fetch_page(
+async def fetch_batch(
     rotator: ProxyRotator,
+    proxy: Optional[str],
     selected_facets: Optional[List[Dict[str, str]]],
-    from_i: int,
-    to_i: int,
+    windows: List[Tuple[int, int]],
     order_by: str,
-) -> Tuple[int, Dict[str, Any]]:
-    proxy = await rotator.next()
-    variables = {
+    gate: Optional[AdaptiveGate] = None,
+) -> Dict[str, Optional[PageNode]]:
+    """
+    Fetch several pagination windows in one POST via aliased productSearch
+    fields; the response maps p0..p{k-1} back onto `windows` by position.
+    """
+    variables: Dict[str, Any] = {
         "selectedFacets": selected_facets or [],
-        "from": from_i,
-        "to": to_i,
         "orderBy": order_by,
     }
-    data = await graphql_post_json(PRODUCT_SEARCH_QUERY, variables, proxy)
-    return (from_i, data)
+    for i, (f, t) in enumerate(windows):
+        variables[f"from{i}"] = f
+        variables[f"to{i}"] = t
+    return await graphql_post_json(
+        build_batched_query(len(windows)), variables, rotator.client_for(proxy), gate=gate
+    )
 
 async def crawl_all_products(
     proxies_path: str,
@@ -184,6 +561,9 @@ async def crawl_all_products(
     concurrency: int = 8,
     order_by: str = "OrderByScoreDESC",
     selected_facets: Optional[List[Dict[str, str]]] = None,
+    per_proxy_streams: int = 100,
+    batch_size: int = 8,
+    use_uring: bool = False,
 ):
     ts = utc_ts()
     base_out = Path(out_dir) / f"scrape_{ts}"
@@ -191,31 +571,53 @@ async def crawl_all_products(
 
     # Load proxies
     proxies = load_proxies(Path(proxies_path))
-    rotator = ProxyRotator(proxies)
-
-    # First call: discover total via recordsFiltered and write the first page
-    first_from = 0
-    first_to = window - 1
-    first_data = await graphql_post_json(
-        PRODUCT_SEARCH_QUERY,
-        {
-            "selectedFacets": selected_facets or [],
-            "from": first_from,
-            "to": first_to,
-            "orderBy": order_by,
-        },
-        proxy_url=await rotator.next(),
+    rotator = ProxyRotator(proxies, per_proxy_streams=per_proxy_streams)
+    try:
+        await _crawl(
+            rotator, base_out, ts, window, concurrency, order_by, selected_facets,
+            batch_size, use_uring,
+        )
+    finally:
+        await rotator.aclose()
+
+async def _crawl(
+    rotator: ProxyRotator,
+    base_out: Path,
+    ts: str,
+    window: int,
+    concurrency: int,
+    order_by: str,
+    selected_facets: Optional[List[Dict[str, str]]],
+    batch_size: int,
+    use_uring: bool,
+):
+    # First call: speculatively fetch a whole first batch of windows and read
+    # recordsFiltered off p0, instead of serializing planning behind a lone
+    # single-page discovery round trip. Windows past the catalog end come
+    # back empty and are discarded below.
+    # The gate starts at --concurrency and can grow to the full proxy-stream
+    # capacity on sustained success; the consumer pool (sized below) always
+    # outnumbers the limit, so additive increase admits real work.
+    gate = AdaptiveGate(
+        initial=concurrency,
+        max_limit=max(1, rotator.n) * rotator.per_proxy_streams,
     )
 
-    search_node = first_data.get("productSearch", {}) or {}
-    total = search_node.get("recordsFiltered", 0) or 0
-    products_first = search_node.get("products", []) or []
+    first_windows = [(i * window, (i + 1) * window - 1) for i in range(max(1, batch_size))]
+    first_pages = await fetch_batch(
+        rotator, rotator.next(), selected_facets, first_windows, order_by, gate=gate
+    )
+    search_node = first_pages.get("p0") or PageNode()
+    total = search_node.recordsFiltered or 0
+    products_first = search_node.products
     if total == 0 and products_first:
         total = len(products_first)
 
     # Save meta
-    (base_out / "meta.json").write_text(
-        json.dumps(
+    # File writes go through a worker thread so they never stall the loop
+    await asyncio.to_thread(
+        (base_out / "meta.json").write_bytes,
+        orjson.dumps(
             {
                 "timestamp_utc": ts,
                 "endpoint": GRAPHQL_ENDPOINT,
@@ -225,89 +627,134 @@ async def crawl_all_products(
                 "estimated_total": total,
                 "run_id": str(uuid.uuid4()),
             },
-            ensure_ascii=False,
-            indent=2,
+            option=orjson.OPT_INDENT_2,
         ),
-        encoding="utf-8",
     )
 
-    # Write first chunk
-    first_path = base_out / f"products_{first_from:08d}_{first_to:08d}.json"
-    first_path.write_text(
-        json.dumps(products_first, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    # Deduplicate on the fly: workers append unique products straight to the
+    # JSONL sink, so there is no read-everything-again pass at the end.
+    # A scalable Bloom filter needs ~10 bits per id versus ~80 bytes for a
+    # set of Python strings; at error_rate=1e-6 a false positive (a product
+    # wrongly skipped) is rarer than one per million ids.
+    seen = ScalableBloomFilter(initial_capacity=100_000, error_rate=1e-6)
+    jsonl_path = base_out / "products_all.jsonl"
+    if use_uring and liburing is not None:
+        jsonl_file = UringBatchWriter(jsonl_path)
+
+        async def jsonl_drain():
+            # flush() blocks on completions; keep it off the loop thread
+            if len(jsonl_file.pending) >= UringBatchWriter.QUEUE_DEPTH:
+                await asyncio.to_thread(jsonl_file.flush)
+    else:
+        jsonl_file = jsonl_path.open("wb")
 
-    # Plan remaining pages
-    sem = asyncio.Semaphore(concurrency)
-    tasks: List[asyncio.Task] = []
+        async def jsonl_drain():
+            return None
+    write_lock = asyncio.Lock()
 
-    async def worker(f: int, t: int) -> int:
-        async with sem:
-            frm, data = await fetch_page(rotator, selected_facets, f, t, order_by)
-            node = data.get("productSearch", {}) or {}
-            prods = node.get("products", []) or []
+    async def emit_unique(prods: List[Product]):
+        async with write_lock:
+            for p in prods:
+                pid = p.productId
+                if pid and pid not in seen:
+                    seen.add(pid)
+                    jsonl_file.write(msgspec.json.encode(p) + b"\n")
+            await jsonl_drain()
+
+    # Write the speculative first batch; windows past the catalog end are
+    # dropped rather than written as empty files.
+    total_downloaded = 0
+    pages_written = 0
+    for i, (f, t) in enumerate(first_windows):
+        if i > 0 and total and f >= total:
+            continue
+        node = first_pages.get(f"p{i}") or PageNode()
+        outp = base_out / f"products_{f:08d}_{t:08d}.json"
+        await asyncio.to_thread(
+            outp.write_bytes, msgspec.json.format(msgspec.json.encode(node.products), indent=2)
+        )
+        await emit_unique(node.products)
+        total_downloaded += len(node.products)
+        pages_written += 1
+
+    # Plan remaining pages. Per-proxy semaphores keep each connection at the
+    # server's H2 stream limit; the adaptive gate bounds total in-flight
+    # work and backs off when proxies start seeing 429/503.
+    async def worker(group: List[Tuple[int, int]]) -> int:
+        nonlocal pages_written
+        proxy = rotator.next()
+        async with gate, rotator.sem_for(proxy):
+            pages = await fetch_batch(
+                rotator, proxy, selected_facets, group, order_by, gate=gate
+            )
+        got = 0
+        for i, (f, t) in enumerate(group):
+            node = pages.get(f"p{i}") or PageNode()
+            prods = node.products
             outp = base_out / f"products_{f:08d}_{t:08d}.json"
-            outp.write_text(json.dumps(prods, ensure_ascii=False, indent=2), encoding="utf-8")
-            return len(prods)
-
-    pages: List[Tuple[int, int]] = []
-    if total and total > window:
-        last_index = total - 1
-        current = window
-        while current <= last_index:
-            f = current
-            t = min(current + window - 1, last_index)
-            pages.append((f, t))
-            current = t + 1
+            await asyncio.to_thread(
+                outp.write_bytes, msgspec.json.format(msgspec.json.encode(prods), indent=2)
+            )
+            await emit_unique(prods)
+            got += len(prods)
+            pages_written += 1
+        return got
+
+    covered = len(first_windows) * window
+    if total:
+        pages = [(f, min(f + window - 1, total - 1)) for f in range(covered, total, window)]
     else:
-        # Conservative rolling plan with a safety cap
-        current = window
-        max_safety_pages = 2000  # lower cap to avoid overscheduling
-        for _ in range(max_safety_pages):
-            f = current
-            t = current + window - 1
-            pages.append((f, t))
-            current = t + 1
-
-    for f, t in pages:
-        tasks.append(asyncio.create_task(worker(f, t)))
-
-    total_downloaded = len(products_first)
-    for coro in asyncio.as_completed(tasks):
-        got = await coro
-        total_downloaded += got
-        # Empty pages will be written as [] and counted as 0
-
-    # Deduplicate into a JSONL
-    seen = set()
-    jsonl_path = base_out / "products_all.jsonl"
-    with jsonl_path.open("w", encoding="utf-8") as w:
-        for part in sorted(base_out.glob("products_*.json")):
-            if part.name == "products_all.jsonl":
-                continue
+        # Conservative rolling plan with a safety cap to avoid overscheduling
+        pages = [(covered + i * window, covered + (i + 1) * window - 1) for i in range(2000)]
+
+    # Bounded pool: `concurrency` long-lived consumers drain a queue of page
+    # groups instead of one Task (and coroutine frame) per group up front.
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(0, len(pages), batch_size):
+        queue.put_nowait(pages[i : i + batch_size])
+
+    errors: List[Exception] = []
+
+    async def consumer():
+        nonlocal total_downloaded
+        while True:
+            group = await queue.get()
             try:
-                arr = json.loads(part.read_text(encoding="utf-8"))
-            except Exception:
-                continue
-            for p in arr:
-                pid = p.get("productId")
-                if pid and pid not in seen:
-                    seen.add(pid)
-                    w.write(json.dumps(p, ensure_ascii=False) + "\n")
+                total_downloaded += await worker(group)
+                # Empty pages will be written as [] and counted as 0
+            except Exception as e:
+                errors.append(e)
+            finally:
+                queue.task_done()
+
+    # The pool has to outnumber the in-flight cap enforced by the gate and
+    # the per-proxy stream semaphores, otherwise the consumer count itself
+    # becomes the bound and the H2 multiplexing headroom goes unused. Cap
+    # at the number of queued groups; idle consumers just park on the gate.
+    n_consumers = min(gate.max_limit, queue.qsize() or 1)
+    consumers = [asyncio.create_task(consumer()) for _ in range(n_consumers)]
+    try:
+        await queue.join()
+    finally:
+        for c in consumers:
+            c.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        jsonl_file.close()
+    if errors:
+        raise RuntimeError(f"{len(errors)} page group(s) failed; first: {errors[0]}") from errors[0]
 
     # Manifest
-    (base_out / "manifest.json").write_text(
-        json.dumps(
+    await asyncio.to_thread(
+        (base_out / "manifest.json").write_bytes,
+        orjson.dumps(
             {
                 "timestamp_utc": ts,
-                "pages_written": len(list(base_out.glob("products_*.json"))),
+                "pages_written": pages_written,
                 "unique_products": len(seen),
                 "jsonl": str(jsonl_path),
             },
-            ensure_ascii=False,
-            indent=2,
+            option=orjson.OPT_INDENT_2,
         ),
-        encoding="utf-8",
     )
 
 def main():
@@ -315,10 +762,19 @@ def main():
     ap.add_argument("--proxies", required=True, help="Path to proxies file (host:port:user:pass per line)")
     ap.add_argument("--out", default="./scrapes", help="Output directory")
     ap.add_argument("--window", type=int, default=48, help="Pagination window size (from/to inclusive)")
-    ap.add_argument("--concurrency", type=int, default=8, help="Concurrent requests")
+    ap.add_argument("--concurrency", type=int, default=8, help="Concurrent worker tasks")
+    ap.add_argument("--per-proxy-streams", type=int, default=100,
+                    help="Max in-flight requests per proxy (H2 max_concurrent_streams)")
+    ap.add_argument("--batch-size", type=int, default=8,
+                    help="Pagination windows packed per GraphQL request (aliased productSearch)")
+    ap.add_argument("--use-uring", action="store_true",
+                    help="Write the JSONL through io_uring batched submits (Linux + liburing)")
     ap.add_argument("--order-by", default="OrderByScoreDESC", help="OrderBy code to stabilize pagination")
     args = ap.parse_args()
 
+    if uvloop is not None:
+        uvloop.install()
+
     Path(args.out).mkdir(parents=True, exist_ok=True)
 
     asyncio.run(
@@ -329,6 +785,9 @@ def main():
             concurrency=args.concurrency,
             order_by=args.order_by,
             selected_facets=None,  # e.g. [{"key": "brand", "value": "123"}]
+            per_proxy_streams=args.per_proxy_streams,
+            batch_size=args.batch_size,
+            use_uring=args.use_uring,
         )
     )
 